@@ -15,15 +15,65 @@
 import socket
 import numpy as np
 import math
+import ctypes
+import ctypes.util
+import errno
+import os
+import threading
+
+# Linux can send all the tiles of a frame with one sendmmsg() system call.
+class _iovec(ctypes.Structure):
+  _fields_ = [('iov_base', ctypes.c_void_p),
+              ('iov_len', ctypes.c_size_t)]
+
+class _msghdr(ctypes.Structure):
+  _fields_ = [('msg_name', ctypes.c_void_p),
+              ('msg_namelen', ctypes.c_uint32),
+              ('msg_iov', ctypes.POINTER(_iovec)),
+              ('msg_iovlen', ctypes.c_size_t),
+              ('msg_control', ctypes.c_void_p),
+              ('msg_controllen', ctypes.c_size_t),
+              ('msg_flags', ctypes.c_int)]
+
+class _mmsghdr(ctypes.Structure):
+  _fields_ = [('msg_hdr', _msghdr),
+              ('msg_len', ctypes.c_uint)]
+
+# Without a findable C library (as on Windows) or sendmmsg() tiles are sent one by one.
+_libc_name = ctypes.util.find_library('c')
+_sendmmsg = None
+if _libc_name is not None:
+  try:
+    _sendmmsg = ctypes.CDLL(_libc_name, use_errno=True).sendmmsg
+    _sendmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(_mmsghdr), ctypes.c_uint, ctypes.c_int]
+    _sendmmsg.restype = ctypes.c_int
+  except (OSError, AttributeError, TypeError):
+    _sendmmsg = None
+
+# Sends never block: if the kernel send queue is full the frame is dropped
+# rather than stalling the caller's animation loop.
+_MSG_DONTWAIT = getattr(socket, 'MSG_DONTWAIT', 0)
 
 class FlaschenNP(object):
   '''A Framebuffer display interface that sends a frame via UDP.
 
-  JBY: modified to use numpy as storage backend.'''
+  JBY: modified to use numpy as storage backend.
+
+  self.data is a C-contiguous, row-major (height, width, 3) uint8 array,
+  the same layout as the PPM P6 payload, and it lives inside the packet
+  buffer. Draw into it in place; assigning a new array to self.data would
+  detach it from what send() transmits.'''
 
   # Maximum UDP packet size (safe value)
   MAX_UDP_PACKET = 65507
 
+  # Socket send buffer, big enough to queue several tiled frames
+  SEND_BUFFER_SIZE = 4 * 1024 * 1024
+
+  # One connected UDP socket per (host, port), shared by every display using it
+  _sockets = {}
+  _sockets_lock = threading.Lock()
+
   def __init__(self, host, port, width, height, layer=0, transparent=False):
     '''
 
@@ -39,21 +89,119 @@ class FlaschenNP(object):
     self.height = height
     self.layer = layer
     self.transparent = transparent
-    self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    self._sock.connect((host, port))
-    header = ''.join(["P6\n",
-                      "%d %d\n" % (self.width, self.height),
-                      "255\n"])
-    footer = ''.join(["0\n",
-                      "0\n",
-                      "%d\n" % self.layer])
-    self._bytedata = bytearray(width * height * 3 + len(header) + len(footer))
-    self._bytedata[0:len(header)] = str.encode(header)
-    self._bytedata[-1 * len(footer):] = str.encode(footer)
-    self.data = np.zeros((height, width, 3), 'uint8')
-    self._header_len = len(header)
-    self._footer_len = len(footer)
+    self._sock = self._shared_socket(host, port)
+    # The pixel array is a view into the packet buffer, so sending a frame
+    # doesn't need to copy it.
+    self._bytedata, self.data = self._packet(width, height, 0, 0)
+    assert self.data.flags['C_CONTIGUOUS']
+    # Columns drawn into by set_points() since the last zero_dirty()
+    self._dirty_cols = np.zeros(width, dtype=bool)
+    self._header_len = len(self._ppm_header(width, height))
+    self._footer_len = len(self._ppm_footer(0, 0))
     self._buffer_size = len(self._bytedata)
+    self._tiles = []
+    if self._buffer_size > self.MAX_UDP_PACKET:
+      self._init_tiles()
+
+  @classmethod
+  def _shared_socket(cls, host, port):
+    '''Return the socket connected to host:port, creating it on first use.'''
+    with cls._sockets_lock:
+      sock = cls._sockets.get((host, port))
+      if sock is None:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, cls.SEND_BUFFER_SIZE)
+        sock.connect((host, port))
+        cls._sockets[(host, port)] = sock
+      return sock
+
+  @staticmethod
+  def _ppm_header(width, height):
+    return b'P6\n%d %d\n255\n' % (width, height)
+
+  def _ppm_footer(self, x_offset, y_offset):
+    return b'%d\n%d\n%d\n' % (x_offset, y_offset, self.layer)
+
+  def _packet(self, width, height, x_offset, y_offset):
+    '''Build a packet for a width x height image drawn at the given offset.
+
+    The header and footer are written once; returns the packet bytearray and
+    a (height, width, 3) uint8 view of the pixel bytes inside it.
+    '''
+    header = self._ppm_header(width, height)
+    footer = self._ppm_footer(x_offset, y_offset)
+    packet = bytearray(width * height * 3 + len(header) + len(footer))
+    packet[0:len(header)] = header
+    packet[-1 * len(footer):] = footer
+    pixels = np.frombuffer(packet, dtype='uint8', count=width * height * 3,
+                           offset=len(header)).reshape((height, width, 3))
+    return packet, pixels
+
+  def _init_tiles(self):
+    '''Preallocate one packet per tile for images too large for a single packet.
+
+    Each entry of self._tiles is (packet, pixels, region): the tile's packet
+    buffer with its header and offset footer already filled in, a view of the
+    pixel bytes inside that packet, and the matching region of self.data.
+    '''
+    # Calculate the max tile size that can fit in a UDP packet
+    pixels_per_packet = (self.MAX_UDP_PACKET - self._header_len - self._footer_len) // 3
+    
+    # Calculate optimal tile dimensions
+    tile_height = min(self.height, int(math.sqrt(pixels_per_packet)))
+    tile_width = min(self.width, pixels_per_packet // tile_height)
+    
+    # If we can't fit even one row, reduce height
+    if tile_width < 1:
+      tile_width = 1
+      tile_height = min(self.height, pixels_per_packet)
+    
+    for y_offset in range(0, self.height, tile_height):
+      for x_offset in range(0, self.width, tile_width):
+        # Calculate the current tile dimensions
+        current_tile_width = min(tile_width, self.width - x_offset)
+        current_tile_height = min(tile_height, self.height - y_offset)
+        
+        # Create the tile packet, with the tile's offset in its footer
+        tile_data, tile_pixels = self._packet(current_tile_width, current_tile_height,
+                                              x_offset, y_offset)
+        
+        # The relevant portion of the image
+        tile_image = self.data[y_offset:y_offset + current_tile_height,
+                               x_offset:x_offset + current_tile_width]
+        
+        self._tiles.append((tile_data, tile_pixels, tile_image))
+
+    self._mmsg = None
+    if _sendmmsg is not None:
+      # Point one message header at each tile packet; the socket is connected,
+      # so no destination address is needed.
+      self._iov = (_iovec * len(self._tiles))()
+      self._mmsg = (_mmsghdr * len(self._tiles))()
+      for i, (tile_data, _, _) in enumerate(self._tiles):
+        self._iov[i].iov_base = ctypes.addressof((ctypes.c_char * len(tile_data)).from_buffer(tile_data))
+        self._iov[i].iov_len = len(tile_data)
+        self._mmsg[i].msg_hdr.msg_iov = ctypes.pointer(self._iov[i])
+        self._mmsg[i].msg_hdr.msg_iovlen = 1
+
+  def _send_tiles(self):
+    '''Send every tile packet, in as few system calls as possible.'''
+    if self._mmsg is None:
+      for tile_data, _, _ in self._tiles:
+        try:
+          self._sock.send(tile_data, _MSG_DONTWAIT)
+        except BlockingIOError:
+          pass  # Send queue is full; skip this tile
+      return
+    sent = 0
+    while sent < len(self._tiles):
+      n = _sendmmsg(self._sock.fileno(), ctypes.byref(self._mmsg[sent]), len(self._tiles) - sent, _MSG_DONTWAIT)
+      if n < 0:
+        err = ctypes.get_errno()
+        if err in (errno.EAGAIN, errno.EWOULDBLOCK):
+          return  # Send queue is full; drop the rest of this frame
+        raise OSError(err, os.strerror(err))
+      sent += n
 
   def set(self, x, y, color):
     '''Set the pixel at the given coordinates to the specified color.
@@ -68,19 +216,70 @@ class FlaschenNP(object):
     if color == (0, 0, 0) and not self.transparent:
       color = (1, 1, 1)
 
-    #offset = (x + y * self.width) * 3 + self._header_len
-    #self._data[offset] = color[0]
-    #self._data[offset + 1] = color[1]
-    #self._data[offset + 2] = color[2]
-    self.data[y, x, 0] = color[0]
-    self.data[y, x, 1] = color[1]
-    self.data[y, x, 2] = color[2]
+    # Write the packet bytes directly; bytearray item stores are much cheaper
+    # than scalar ndarray indexing, and self.data sees the same memory.
+    offset = (x + y * self.width) * 3 + self._header_len
+    self._bytedata[offset] = color[0]
+    self._bytedata[offset + 1] = color[1]
+    self._bytedata[offset + 2] = color[2]
+
+  def set_points(self, xs, ys, colors):
+    '''Set many pixels at once.
+
+    Points outside the display are skipped, and black is drawn as (1, 1, 1)
+    unless the display is transparent, exactly as set() does.
+
+    Args:
+      xs: array of x offsets
+      ys: array of y offsets, same length as xs
+      colors: (N, 3) array of (r, g, b) color values, 0-255
+    '''
+    xs = np.asarray(xs)
+    ys = np.asarray(ys)
+    colors = np.asarray(colors, dtype=np.uint8)
+    m = (xs >= 0) & (xs < self.width) & (ys >= 0) & (ys < self.height)
+    colors = colors[m]
+    if not self.transparent:
+      colors = np.where((colors == 0).all(axis=-1, keepdims=True), np.uint8(1), colors)
+    self.data[ys[m], xs[m]] = colors
+    self._dirty_cols[xs[m]] = True
+
+  def mark_dirty(self, xs):
+    '''Record columns drawn into directly through self.data for zero_dirty().
+
+    Args:
+      xs: array of x offsets that were written
+    '''
+    self._dirty_cols[xs] = True
 
   def ijset(self, ii, jj, color):
     return self.set(jj, ii, color)
 
+  def fill(self, color):
+    '''Set every pixel to the specified color.
+
+    Args:
+      color: A 3 tuple of (r, g, b) color values, 0-255
+    '''
+    if tuple(color) == (0, 0, 0) and not self.transparent:
+      color = (1, 1, 1)
+    self.data[:] = color
+    self._dirty_cols[:] = True
+
   def zero(self):
-    self.data[:] = 0
+    self.data.fill(0)
+    self._dirty_cols[:] = False
+
+  def zero_dirty(self):
+    '''Clear only the columns drawn by set_points() (or passed to mark_dirty())
+    since the last clear.
+
+    Much cheaper than zero() when a frame only touches a few columns. Pixels
+    written with set() or directly through self.data are not tracked.
+    '''
+    if self._dirty_cols.any():
+      self.data[:, self._dirty_cols] = 0
+      self._dirty_cols[:] = False
   
   def send(self):
     '''Send the updated pixels to the display.
@@ -89,54 +288,14 @@ class FlaschenNP(object):
     the maximum UDP packet size and sends each tile individually with the
     correct offset.
     '''
-    # Check if we need to tile the image
-    if self._buffer_size > self.MAX_UDP_PACKET:
-      # Calculate the max tile size that can fit in a UDP packet
-      pixels_per_packet = (self.MAX_UDP_PACKET - self._header_len - self._footer_len) // 3
-      
-      # Calculate optimal tile dimensions
-      tile_height = min(self.height, int(math.sqrt(pixels_per_packet)))
-      tile_width = min(self.width, pixels_per_packet // tile_height)
-      
-      # If we can't fit even one row, reduce height
-      if tile_width < 1:
-        tile_width = 1
-        tile_height = min(self.height, pixels_per_packet)
-      
-      # Send tiles
-      for y_offset in range(0, self.height, tile_height):
-        for x_offset in range(0, self.width, tile_width):
-          # Calculate the current tile dimensions
-          current_tile_width = min(tile_width, self.width - x_offset)
-          current_tile_height = min(tile_height, self.height - y_offset)
-          
-          # Create a header for this tile
-          tile_header = ''.join(["P6\n",
-                               "%d %d\n" % (current_tile_width, current_tile_height),
-                               "255\n"])
-          
-          # Create a footer with the offset
-          tile_footer = ''.join(["%d\n" % x_offset,
-                              "%d\n" % y_offset,
-                              "%d\n" % self.layer])
-          
-          # Create the tile data
-          tile_data = bytearray(current_tile_width * current_tile_height * 3 + len(tile_header) + len(tile_footer))
-          tile_data[0:len(tile_header)] = str.encode(tile_header)
-          tile_data[-1 * len(tile_footer):] = str.encode(tile_footer)
-          
-          # Extract the relevant portion of the image
-          tile_image = self.data[y_offset:y_offset + current_tile_height, 
-                                x_offset:x_offset + current_tile_width, :]
-          
-          # Copy the tile image data into the buffer
-          tile_bytes = tile_image.tobytes()
-          tile_data[len(tile_header):len(tile_header) + len(tile_bytes)] = tile_bytes
-          
-          # Send the tile
-          self._sock.send(tile_data)
+    if self._tiles:
+      # Copy each tile's pixels into its prebuilt packet, then send them all
+      for _, tile_pixels, tile_image in self._tiles:
+        np.copyto(tile_pixels, tile_image)
+      self._send_tiles()
     else:
-      # Send the entire image in one packet
-      self._bytedata[self._header_len:self._header_len + self.data.nbytes] = self.data.tobytes()
-      self._sock.send(self._bytedata)
-
+      # Send the entire image in one packet (self.data already lives in it)
+      try:
+        self._sock.send(self._bytedata, _MSG_DONTWAIT)
+      except BlockingIOError:
+        pass  # Send queue is full; drop this frame
@@ -10,28 +10,40 @@ import flaschen_np
 import numpy as np
 import time
 import argparse
-import random
 import signal
 import sys
 import json
 import os
+import threading
+
+try:
+    import numba
+    from numba import njit, prange
+    # Prefer OpenMP to TBB: once a parallel function has run on a thread other
+    # than the main one (as in matrix_web_controller.py), TBB hangs the
+    # interpreter at exit. A priority set in the environment still wins.
+    if 'NUMBA_THREADING_LAYER_PRIORITY' not in os.environ:
+        numba.config.THREADING_LAYER_PRIORITY = ['omp', 'tbb', 'workqueue']
+except ImportError:
+    # Numba is optional; without it drops are drawn with plain NumPy
+    njit = None
+
+try:
+    import inotify_simple
+except ImportError:
+    # Without inotify the settings file is polled once a second instead
+    inotify_simple = None
 
 # Defaults (match the C++ version)
 Z_LAYER = 2        # (0-15) 0=background
 DELAY = 50         # milliseconds
 FADE_STEP = 8      # Match C++ fade step
 NUM_DOTS = 6
+MAX_TRAIL_LENGTH = 64  # Upper bound on raindrop trail length
+COLUMN_BLOCK = 16      # Columns per band when rendering drops in parallel
 DEFAULT_MATRIX_COLOR = (0, 255, 0)  # Matrix green
 SETTINGS_FILE = 'matrix_settings.json'  # For reading color changes at runtime
 
-# Handle ctrl+c gracefully
-interrupt_received = False
-def signal_handler(signal, frame):
-    global interrupt_received
-    interrupt_received = True
-signal.signal(signal.SIGINT, signal_handler)
-signal.signal(signal.SIGTERM, signal_handler)
-
 # Function to check for color changes
 def check_color_change(current_color):
     try:
@@ -61,205 +73,247 @@ def check_color_change(current_color):
     # Return the current color if no change or error
     return current_color
 
-def color_gradient(start, end, r1, g1, b1, r2, g2, b2):
-    """Create a color gradient from RGB1 to RGB2"""
-    colors = []
-    for i in range(end - start + 1):
-        k = i / float(end - start)
-        r = int(r1 + (r2 - r1) * k)
-        g = int(g1 + (g2 - g1) * k)
-        b = int(b1 + (b2 - b1) * k)
-        colors.append((r, g, b))
-    return colors
+def watch_color_changes(current_color):
+    """Follow color changes in SETTINGS_FILE from a background thread.
 
-class MatrixRaindrop:
-    def __init__(self, x, height, speed=1, color=None):
-        self.x = x                      # x-position
-        self.y = 0                      # starts at the top
-        self.height = height            # screen height
-        self.speed = 1                  # consistent speed like C++ version
-        self.length = random.randint(15, 35)  # longer trail lengths to match C++ version
-        self.active = True              # whether this raindrop is active
-        self.brightness = 255           # start bright (the head)
-        # If random colors are enabled, assign a random color to this raindrop
-        self.color = color
-        if color == "random":
-            # Pick a random color from a set of good matrix colors
-            color_options = [
-                (0, 255, 0),    # green
-                (255, 0, 0),    # red
-                (0, 170, 255),  # blue (cyan-ish)
-                (255, 255, 0),  # yellow
-                (255, 0, 255),  # magenta
-                (0, 255, 255),  # cyan
-            ]
-            self.color = random.choice(color_options)
-        elif isinstance(color, tuple) and len(color) == 3:
-            # If it's already an RGB tuple, use it directly
-            self.color = color
+    Returns a one-element list whose item is replaced with the new color
+    whenever the settings change, so the render loop never touches the
+    filesystem itself.
+    """
+    shared_color = [check_color_change(current_color)]
 
-    def update(self):
-        """Move the raindrop down the screen"""
-        self.y += self.speed
-        if self.y - self.length > self.height:
-            self.active = False
-        return self.active
+    def reload_settings():
+        shared_color[0] = check_color_change(shared_color[0])
 
-def main():
-    parser = argparse.ArgumentParser(
-        description='Matrix Effect for Flaschen Taschen',
-        formatter_class=lambda prog: argparse.ArgumentDefaultsHelpFormatter(prog)
-    )
-    
-    parser.add_argument('--host', type=str, default='localhost', help='Host to send packets to')
-    parser.add_argument('--port', type=int, default=1337, help='Port to send packets to')
-    parser.add_argument('--height', type=int, default=35, help='Canvas height')
-    parser.add_argument('--width', type=int, default=45, help='Canvas width')
-    parser.add_argument('--layer', '-l', type=int, default=Z_LAYER, help='Canvas layer (0-15)')
-    parser.add_argument('--time', '-t', type=int, default=24*60*60, help='How long to run for before exiting (seconds)')
-    parser.add_argument('--delay', '-d', type=int, default=DELAY, help='Frame delay in milliseconds')
-    parser.add_argument('--color', '-c', type=str, default='00ff00', 
-                       help='Matrix color in RRGGBB hex format or "random" for random colors (default: green 00ff00)')
-    parser.add_argument('--density', type=float, default=1.0/NUM_DOTS, 
-                       help=f'Density of raindrops (0.0-1.0, default: 1/{NUM_DOTS})')
-    
-    args = parser.parse_args()
-    
-    # Parse the matrix color
-    matrix_color = DEFAULT_MATRIX_COLOR
-    is_random_color = False
+    def watch():
+        if inotify_simple is not None:
+            # Watch the directory so the file can be replaced, not just rewritten
+            inotify = inotify_simple.INotify()
+            flags = inotify_simple.flags
+            inotify.add_watch(os.path.dirname(os.path.abspath(SETTINGS_FILE)),
+                              flags.CLOSE_WRITE | flags.MOVED_TO)
+            name = os.path.basename(SETTINGS_FILE)
+            while True:
+                if any(event.name == name for event in inotify.read()):
+                    reload_settings()
+        else:
+            while True:
+                time.sleep(1.0)
+                reload_settings()
+
+    threading.Thread(target=watch, daemon=True).start()
+    return shared_color
+
+def color_gradient(start, end, rgb1, rgb2):
+    """Create a (end - start + 1, 3) uint8 color gradient from RGB1 to RGB2"""
+    k = np.arange(end - start + 1) / float(end - start)
+    rgb1 = np.asarray(rgb1, dtype=np.float64)
+    rgb2 = np.asarray(rgb2, dtype=np.float64)
+    return (rgb1 + (rgb2 - rgb1) * k[:, None]).astype(np.uint8)
+
+def shade_palette(color, opaque=True):
+    """Brightness-indexed (256, 3) palette fading a raindrop's color to black"""
+    palette = color_gradient(0, 255, (0, 0, 0), color)
+    palette[255] = 255  # Head is always white
+    if opaque:
+        # Match FlaschenNP.set(): black is drawn as (1, 1, 1) unless transparent
+        palette[(palette == 0).all(axis=1)] = 1
+    return palette
+
+def trail_palette(color, opaque=True):
+    """(MAX_TRAIL_LENGTH, 3) uint8 color for each position along a trail, head first"""
+    brightness = np.maximum(0, 255 - np.arange(MAX_TRAIL_LENGTH) * FADE_STEP)
+    return shade_palette(color, opaque=opaque)[brightness]
+
+def draw_drops(ft, dx, dy, dl, dp, palettes):
+    """Draw every raindrop trail into ft with a single set_points() call"""
+    # Only the part of each trail between row height - 1 and row 0 is visible
+    i_start = np.maximum(0, dy - ft.height + 1)
+    counts = np.maximum(0, np.minimum(dl, dy + 1) - i_start)
+    # Expand each drop into one entry per visible trail pixel, head first
+    kk = np.repeat(np.arange(dx.size), counts)
+    i = np.arange(kk.size) - np.repeat(np.cumsum(counts) - counts, counts) + i_start[kk]
+    colors = palettes[dp[kk], i]
+    ft.set_points(dx[kk], dy[kk] - i, colors)
+
+if njit is not None:
+    @njit(parallel=True, cache=True)
+    def render_drops(frame, dx, dy, dl, dp, palettes, blocks):
+        """Draw every raindrop trail straight into the framebuffer.
+
+        Drops must be sorted by column, with blocks[j]:blocks[j + 1] holding
+        the drops of the j-th band of COLUMN_BLOCK columns. Bands are drawn
+        in parallel and never share pixels, and within a band drops are drawn
+        in order, so overlapping drops come out the same as a serial loop.
+        """
+        height = frame.shape[0]
+        for j in prange(blocks.size - 1):
+            for k in range(blocks[j], blocks[j + 1]):
+                x = dx[k]
+                # Only visit the part of the trail that is on screen
+                for i in range(max(0, dy[k] - height + 1), min(dl[k], dy[k] + 1)):
+                    y = dy[k] - i
+                    frame[y, x, 0] = palettes[dp[k], i, 0]
+                    frame[y, x, 1] = palettes[dp[k], i, 1]
+                    frame[y, x, 2] = palettes[dp[k], i, 2]
+else:
+    render_drops = None
+
+# Good matrix colors for random color mode
+RANDOM_COLORS = [
+    (0, 255, 0),    # green
+    (255, 0, 0),    # red
+    (0, 170, 255),  # blue (cyan-ish)
+    (255, 255, 0),  # yellow
+    (255, 0, 255),  # magenta
+    (0, 255, 255),  # cyan
+]
+
+class RandomPool:
+    """Hands out random numbers one at a time from large pregenerated batches"""
+    def __init__(self, draw, size=4096):
+        self._draw = draw      # draw(n) returns an array of n random values
+        self._size = size
+        self._values = []
+        self._pos = 0
+
+    def next(self):
+        if self._pos >= len(self._values):
+            self._values = self._draw(self._size).tolist()
+            self._pos = 0
+        value = self._values[self._pos]
+        self._pos += 1
+        return value
+
+def run(host, port, width, height, layer=Z_LAYER, matrix_color=DEFAULT_MATRIX_COLOR,
+        delay=DELAY, density=1.0/NUM_DOTS, duration=24*60*60,
+        stop_event=None, pause_event=None, shared_color=None):
+    """Run the matrix effect until duration seconds have passed or stop_event is set.
+
+    matrix_color is an (r, g, b) tuple or "random". While pause_event is set
+    the animation holds its last frame. shared_color is a one-element list
+    whose item can be replaced with a new color while running; by default it
+    follows SETTINGS_FILE. Returns True if stopped through stop_event.
+    """
+    if stop_event is None:
+        stop_event = threading.Event()
     
-    if args.color == "random":
-        is_random_color = True
-        matrix_color = "random"
-    elif args.color and len(args.color) == 6:
-        try:
-            r = int(args.color[0:2], 16)
-            g = int(args.color[2:4], 16)
-            b = int(args.color[4:6], 16)
-            matrix_color = (r, g, b)
-        except ValueError:
-            print(f"Invalid color format: {args.color}. Using default green.")
+    # Initialize the display
+    ft = flaschen_np.FlaschenNP(host, port, width, height, layer)
+    ft.zero()  # Clear the display
+    opaque = not ft.transparent
     
-    # Set up the color palette (can change during runtime)
-    def update_palette(color):
-        # Colors from 0 to 240: main gradient from black to matrix color
+    # Random numbers for spawning raindrops, generated in batches
+    rng = np.random.default_rng()
+    chance = RandomPool(lambda n: rng.random(n))
+    spawn_x = RandomPool(lambda n: rng.integers(0, width, n))
+    trail_length = RandomPool(lambda n: rng.integers(15, 36, n))  # longer trail lengths to match C++ version
+    random_color = RandomPool(lambda n: rng.integers(0, len(RANDOM_COLORS), n))
+    def new_raindrop(color):
+        """Pick the x-position, trail length and RGB color for a new raindrop"""
         if color == "random":
-            # For random color mode, we don't need a palette
-            return []
-            
-        palette = []
-        bg_color = (0, 0, 0)  # Background is always black
-        
-        palette.extend(color_gradient(0, 240, bg_color[0], bg_color[1], bg_color[2], 
-                                     color[0], color[1], color[2]))
-        
-        # Colors from 241 to 254: gradient from matrix color to white (for the glow effect)
-        palette.extend(color_gradient(241, 254, 
-                                     color[0], color[1], color[2],
-                                     255, 255, 255))
-        
-        # Add pure white for the leading edge
-        palette.append((255, 255, 255))
-        
-        return palette
+            # If random colors are enabled, assign a random color to this raindrop
+            color = RANDOM_COLORS[random_color.next()]
+        return spawn_x.next(), trail_length.next(), color
     
-    # Initialize the display
-    ft = flaschen_np.FlaschenNP(args.host, args.port, args.width, args.height, args.layer)
-    ft.zero()  # Clear the display
+    # Active raindrops, one entry per drop in each array: head position,
+    # trail length, and index of the drop's palette in palette_table
+    drop_x = np.empty(0, np.int32)
+    drop_y = np.empty(0, np.int32)
+    drop_len = np.empty(0, np.int32)
+    drop_pal = np.empty(0, np.int32)
     
-    # Active raindrops
-    raindrops = []
+    # Per-trail-position colors for every drop color, built once up front
+    palette_ids = {}
+    palette_table = np.empty((0, MAX_TRAIL_LENGTH, 3), np.uint8)
+    def add_palette(color):
+        nonlocal palette_table
+        if color != "random" and color not in palette_ids:
+            palette_ids[color] = len(palette_table)
+            palette_table = np.concatenate([palette_table, trail_palette(color, opaque=opaque)[None]])
+    for color in RANDOM_COLORS + [matrix_color]:
+        add_palette(color)
+    
+    # First column of each band of columns, plus the end of the display
+    column_blocks = np.append(np.arange(0, width, COLUMN_BLOCK), width)
     
     # Estimate a good number of initial raindrops based on screen size and density
-    max_raindrops = int(args.width * args.height * args.density / 20)
+    max_raindrops = int(width * height * density / 20)
     
     # Main loop
     start_time = time.time()
     frame_count = 0
-    last_color_check = time.time()
+    if shared_color is None:
+        shared_color = watch_color_changes(matrix_color)
+    frame_period = delay / 1000.0
+    next_frame_time = time.monotonic()
     
     try:
-        while not interrupt_received and (time.time() - start_time) <= args.time:
-            # Check for color changes every second
-            if time.time() - last_color_check > 1.0:
-                new_color = check_color_change(matrix_color)
-                if new_color != matrix_color:
-                    matrix_color = new_color
-                    is_random_color = (matrix_color == "random")
-                last_color_check = time.time()
+        while not stop_event.is_set() and (time.time() - start_time) <= duration:
+            if pause_event is not None and pause_event.is_set():
+                # Hold the current frame, and pick up the schedule when resumed
+                stop_event.wait(frame_period)
+                next_frame_time = time.monotonic()
+                continue
+            
+            # Pick up any color change seen by the settings watcher
+            new_color = shared_color[0]
+            if new_color != matrix_color:
+                matrix_color = new_color
+                add_palette(matrix_color)
             
-            # Clear the display for this frame
-            ft.zero()
+            # Clear the columns drawn in the last frame
+            ft.zero_dirty()
             
             # Randomly add new raindrops
+            new_drops = []
             if frame_count % 4 == 0:  # Add drops every 4 frames like C++ version
                 # Add a specific number of drops at random positions
-                if random.random() < 0.5:  # 50% chance of adding a drop
-                    x = random.randint(0, args.width - 1)
-                    if is_random_color:
-                        raindrops.append(MatrixRaindrop(x, args.height, color="random"))
-                    else:
-                        raindrops.append(MatrixRaindrop(x, args.height, color=matrix_color))
+                if chance.next() < 0.5:  # 50% chance of adding a drop
+                    new_drops.append(new_raindrop(matrix_color))
                 
                 # For wider displays, occasionally add a second drop in the same frame
-                if args.width > 100 and random.random() < 0.3:  # 30% chance for second drop on wide displays
-                    x = random.randint(0, args.width - 1)
-                    if is_random_color:
-                        raindrops.append(MatrixRaindrop(x, args.height, color="random"))
-                    else:
-                        raindrops.append(MatrixRaindrop(x, args.height, color=matrix_color))
+                if width > 100 and chance.next() < 0.3:  # 30% chance for second drop on wide displays
+                    new_drops.append(new_raindrop(matrix_color))
             
-            # Update each raindrop
-            new_raindrops = []
-            for drop in raindrops:
-                if drop.update():  # If still active
-                    # Draw the raindrop
-                    for i in range(drop.length):
-                        y = drop.y - i
-                        if 0 <= y < args.height:
-                            # Calculate brightness for this part of the trail
-                            # Head is brightest, tail fades out
-                            brightness = max(0, 255 - (i * FADE_STEP))
-                            
-                            # Apply the color based on brightness
-                            if getattr(drop, 'color', None) is not None:
-                                # Random color mode - use drop's specific color
-                                base_color = drop.color
-                                if brightness == 255:
-                                    # Head is always white
-                                    color = (255, 255, 255)
-                                else:
-                                    # Calculate the color based on brightness
-                                    ratio = brightness / 255.0
-                                    r = int(base_color[0] * ratio)
-                                    g = int(base_color[1] * ratio)
-                                    b = int(base_color[2] * ratio)
-                                    color = (r, g, b)
-                                ft.set(drop.x, y, color)
-                            else:
-                                # This shouldn't happen with our updated code
-                                # But keeping as a fallback
-                                palette = update_palette(matrix_color)
-                                if palette:
-                                    ft.set(drop.x, y, palette[brightness])
-                                else:
-                                    # Fallback for random mode
-                                    ratio = brightness / 255.0
-                                    color = (int(0 * ratio), int(255 * ratio), int(0 * ratio))
-                                    ft.set(drop.x, y, color)
-                    
-                    # Keep active raindrops
-                    new_raindrops.append(drop)
+            if new_drops:
+                xs, lengths, colors = zip(*new_drops)
+                drop_x = np.concatenate([drop_x, np.array(xs, np.int32)])
+                drop_y = np.concatenate([drop_y, np.zeros(len(xs), np.int32)])  # starts at the top
+                drop_len = np.concatenate([drop_len, np.array(lengths, np.int32)])
+                drop_pal = np.concatenate([drop_pal, np.array([palette_ids[c] for c in colors], np.int32)])
+                
+                # Keep drops sorted by column (stable, so overlaps keep their
+                # drawing order) so rendering walks the framebuffer column by column
+                order = np.argsort(drop_x, kind='stable')
+                drop_x, drop_y, drop_len, drop_pal = drop_x[order], drop_y[order], drop_len[order], drop_pal[order]
+            
+            # Move every raindrop down the screen and drop the ones that left it
+            drop_y += 1
+            alive = (drop_y - drop_len) <= height
+            drop_x, drop_y, drop_len, drop_pal = drop_x[alive], drop_y[alive], drop_len[alive], drop_pal[alive]
             
-            # Update the active raindrops list
-            raindrops = new_raindrops
+            if drop_x.size:
+                # Head is brightest, tail fades out
+                if render_drops is not None:
+                    blocks = np.searchsorted(drop_x, column_blocks)
+                    render_drops(ft.data, drop_x, drop_y, drop_len, drop_pal, palette_table, blocks)
+                    ft.mark_dirty(drop_x)
+                else:
+                    draw_drops(ft, drop_x, drop_y, drop_len, drop_pal, palette_table)
             
             # Send the frame
             ft.send()
             
-            # Sleep to control the frame rate
-            time.sleep(args.delay / 1000.0)
+            # Sleep until the next frame is due, so the time spent drawing
+            # and sending doesn't stretch the frame period
+            next_frame_time += frame_period
+            wait = next_frame_time - time.monotonic()
+            if wait > 0:
+                stop_event.wait(wait)
+            else:
+                # Running behind; start over from now rather than bursting to catch up
+                next_frame_time = time.monotonic()
             
             frame_count += 1
             if frame_count >= 10000:  # Reset to avoid overflow
@@ -271,7 +325,54 @@ def main():
         ft.send()
         print("\nMatrix effect stopped.")
     
-    return 0 if not interrupt_received else 1
+    return stop_event.is_set()
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Matrix Effect for Flaschen Taschen',
+        formatter_class=lambda prog: argparse.ArgumentDefaultsHelpFormatter(prog)
+    )
+    
+    parser.add_argument('--host', type=str, default='localhost', help='Host to send packets to')
+    parser.add_argument('--port', type=int, default=1337, help='Port to send packets to')
+    parser.add_argument('--height', type=int, default=35, help='Canvas height')
+    parser.add_argument('--width', type=int, default=45, help='Canvas width')
+    parser.add_argument('--layer', '-l', type=int, default=Z_LAYER, help='Canvas layer (0-15)')
+    parser.add_argument('--time', '-t', type=int, default=24*60*60, help='How long to run for before exiting (seconds)')
+    parser.add_argument('--delay', '-d', type=int, default=DELAY, help='Frame delay in milliseconds')
+    parser.add_argument('--color', '-c', type=str, default='00ff00', 
+                       help='Matrix color in RRGGBB hex format or "random" for random colors (default: green 00ff00)')
+    parser.add_argument('--density', type=float, default=1.0/NUM_DOTS, 
+                       help=f'Density of raindrops (0.0-1.0, default: 1/{NUM_DOTS})')
+    
+    args = parser.parse_args()
+    
+    # Parse the matrix color
+    matrix_color = DEFAULT_MATRIX_COLOR
+    
+    if args.color == "random":
+        matrix_color = "random"
+    elif args.color and len(args.color) == 6:
+        try:
+            r = int(args.color[0:2], 16)
+            g = int(args.color[2:4], 16)
+            b = int(args.color[4:6], 16)
+            matrix_color = (r, g, b)
+        except ValueError:
+            print(f"Invalid color format: {args.color}. Using default green.")
+    
+    # Handle ctrl+c gracefully. Installed here rather than at import, so
+    # programs that import this module keep their own handlers.
+    stop_event = threading.Event()
+    def signal_handler(signal, frame):
+        stop_event.set()
+    signal.signal(signal.SIGINT, signal_handler)
+    signal.signal(signal.SIGTERM, signal_handler)
+    
+    interrupted = run(args.host, args.port, args.width, args.height, args.layer, matrix_color,
+                      delay=args.delay, density=args.density, duration=args.time,
+                      stop_event=stop_event)
+    return 0 if not interrupted else 1
 
 if __name__ == '__main__':
     sys.exit(main()) 
\ No newline at end of file
@@ -8,17 +8,36 @@ a browser at http://192.168.86.56.
 """
 
 import os
-import subprocess
 import threading
 import time
 import signal
 import json
-from flask import Flask, render_template_string, request, jsonify
+import gzip
+import functools
+import atexit
+import select
+import hashlib
+import numpy as np
+from flask import Flask, Response, request, jsonify
+from flask.json.provider import DefaultJSONProvider
 import flaschen_np
+import matrix_effect
 import socket
 import qrcode
 import sys
 
+try:
+    import orjson
+except ImportError:
+    # Without orjson JSON goes through Flask's default provider
+    orjson = None
+
+try:
+    from waitress import serve
+except ImportError:
+    # Without waitress the app runs on Flask's built-in server
+    serve = None
+
 # Configuration
 HOST = '0.0.0.0'  # Listen on all interfaces
 PORT = 80  # Changed from 8080 to 80
@@ -27,31 +46,164 @@ DISPLAY_HEIGHT = 128
 DISPLAY_LAYER = 2        # Animation layer
 DISPLAY_TEXT_LAYER = 1   # Text layer (lower than animation)
 QR_CODE_LAYER = 2        # Layer for QR code
+SERVER_ADDRESS = "192.168.86.56"  # Address shown, and encoded in the QR code, on the display
+SERVER_URL = f"http://{SERVER_ADDRESS}:{PORT}"
 FT_HOST = 'localhost'
 FT_PORT = 1337
 SETTINGS_FILE = 'matrix_settings.json'
+DISPLAY_REFRESH_INTERVAL = 5.0  # Seconds between resends of an unchanged clock display
+ANIMATION_STOP_TIMEOUT = 2.0  # Seconds to wait for the animation thread to stop
+MAX_REQUEST_BODY = 64 * 1024  # Larger requests are refused with 413
+SCHEDULER_MAX_WAIT = 600  # Longest the scheduler sleeps, in case the clock is set (e.g. by NTP at boot)
 
-# Animation process
-matrix_process = None
-animation_paused = False
+# Animation thread, running matrix_effect.run() in this process
+matrix_thread = None
+matrix_stop = threading.Event()   # Ends the animation thread
+matrix_pause = threading.Event()  # Freezes the animation while set
+matrix_color = [matrix_effect.DEFAULT_MATRIX_COLOR]  # Color the running animation uses for new raindrops
 stop_event = threading.Event()
 animation_state = "Stopped"  # Initial state tracker: "Running", "Paused", "Stopped", or "Blank"
 current_color = "green"  # Default color will be loaded from settings if available
 custom_text = ""  # No default text, will be loaded from settings
-color_change_event = threading.Event()  # Added to signal color change to animation process
+color_change_event = threading.Event()  # Tells the animation thread to redraw the text in the new color
+# Guards the state above, the schedule and drawing on the display layers.
+# Reentrant, as locked handlers call helpers that take it again.
+state_lock = threading.RLock()
+# Wakes the animation thread when the state above changes, instead of it polling
+state_changed = threading.Condition(state_lock)
+state_version = 0  # Bumped on every change, so a wakeup can't be missed
+# Self-pipe that wakes the clock thread early to redraw after a state change
+clock_wake_r, clock_wake_w = os.pipe()
+os.set_blocking(clock_wake_w, False)
 
 # Scheduling settings
 start_time = "06:30"  # Default start time (6:30 AM)
 end_time = "22:00"    # Default end time (10:00 PM)
+schedule_minutes = (6 * 60 + 30, 22 * 60)  # The same, in minutes since midnight
+animation_thread = None  # Runs run_matrix_animation()
 scheduler_thread = None
-scheduler_stop_event = threading.Event()
+schedule_changed = threading.Event()  # Wakes the scheduler to re-arm for new active hours
+
+# Display colors by name
+COLOR_RGB = {
+    "green": (0, 255, 0),
+    "red": (255, 0, 0),
+    "blue": (0, 170, 255),  # Slightly cyan for better visibility
+    "yellow": (255, 255, 0),
+}
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider encoding and decoding with orjson"""
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
 
 # Initialize Flask app
 app = Flask(__name__)
+app.config['MAX_CONTENT_LENGTH'] = MAX_REQUEST_BODY
+if orjson is not None:
+    # Used by jsonify() and body_json()
+    app.json = OrjsonProvider(app)
 
 # Initialize the display interface
 ft = None
 
+# One display connection per layer, created on first use and reused after that
+_ft_cache = {}
+_ft_cache_lock = threading.Lock()
+
+def _get_ft(layer):
+    """Return the shared FlaschenNP for a display layer"""
+    with _ft_cache_lock:
+        layer_ft = _ft_cache.get(layer)
+        if layer_ft is None:
+            layer_ft = flaschen_np.FlaschenNP(FT_HOST, FT_PORT, DISPLAY_WIDTH, DISPLAY_HEIGHT, layer)
+            _ft_cache[layer] = layer_ft
+        return layer_ft
+
+def animation_running():
+    """Return whether the matrix animation thread is running"""
+    return matrix_thread is not None and matrix_thread.is_alive()
+
+def start_animation():
+    """Start the matrix animation thread with the current color"""
+    global matrix_thread, matrix_stop
+    matrix_stop = threading.Event()
+    matrix_pause.clear()
+    matrix_color[0] = _matrix_color_for(current_color)
+    matrix_thread = threading.Thread(
+        target=matrix_effect.run,
+        args=(FT_HOST, FT_PORT, DISPLAY_WIDTH, DISPLAY_HEIGHT, DISPLAY_LAYER, matrix_color[0]),
+        kwargs={'stop_event': matrix_stop, 'pause_event': matrix_pause, 'shared_color': matrix_color})
+    matrix_thread.daemon = True
+    matrix_thread.start()
+
+def stop_animation(timeout=ANIMATION_STOP_TIMEOUT):
+    """Stop the matrix animation thread, if running, and wait for it to clear its layer"""
+    global matrix_thread
+    thread = matrix_thread  # Another stop_animation() may clear the global meanwhile
+    if thread is not None and thread.is_alive():
+        matrix_stop.set()
+        thread.join(timeout)
+        if thread.is_alive():
+            # Keep it, so no second animation starts until this one has exited
+            print("Matrix animation did not stop in time")
+            return
+    if matrix_thread is thread:
+        matrix_thread = None
+
+def wake_clock():
+    """Make the clock thread redraw now rather than at the next second"""
+    try:
+        os.write(clock_wake_w, b'x')
+    except BlockingIOError:
+        pass  # Pipe is full, so a wakeup is already pending
+
+def with_state_lock(func):
+    """Decorator running func while holding state_lock"""
+    @functools.wraps(func)
+    def locked(*args, **kwargs):
+        with state_lock:
+            return func(*args, **kwargs)
+    return locked
+
+def notify_state_change():
+    """Wake the animation and clock threads after changing the animation state, color or text"""
+    global state_version
+    with state_changed:
+        state_version += 1
+        state_changed.notify_all()
+    wake_clock()
+
+def minutes_since_midnight(hhmm):
+    """Convert an "HH:MM" time to minutes since midnight; raises ValueError if it isn't one"""
+    parsed = time.strptime(hhmm, "%H:%M")
+    return parsed.tm_hour * 60 + parsed.tm_min
+
+def set_schedule(new_start_time, new_end_time):
+    """Set the active hours from "HH:MM" start and end times; raises ValueError if either is invalid"""
+    global start_time, end_time, schedule_minutes
+    # Parsed once here; both times are checked before anything changes
+    schedule_minutes = (minutes_since_midnight(new_start_time), minutes_since_midnight(new_end_time))
+    # Keep the strings zero-padded, as the page's dropdowns expect
+    start_time, end_time = ("%02d:%02d" % divmod(minute, 60) for minute in schedule_minutes)
+    schedule_changed.set()
+
+def in_active_hours():
+    """Return whether the current time is within the active hours"""
+    now = time.localtime()
+    start_minute, end_minute = schedule_minutes
+    return start_minute <= now.tm_hour * 60 + now.tm_min < end_minute
+
+def seconds_until_schedule_change():
+    """Return the seconds until the active hours next start or end"""
+    now = time.time()
+    local = time.localtime(now)
+    seconds_today = local.tm_hour * 3600 + local.tm_min * 60 + local.tm_sec + now % 1
+    return min((minute * 60 - seconds_today) % 86400 or 86400 for minute in schedule_minutes)
+
 # Load settings from file if it exists
 def load_settings():
     global current_color, custom_text, start_time, end_time
@@ -61,14 +213,17 @@ def load_settings():
                 settings = json.load(f)
                 current_color = settings.get('color', 'green')
                 custom_text = settings.get('text', '')
-                start_time = settings.get('start_time', '06:30')
-                end_time = settings.get('end_time', '22:00')
+                set_schedule(settings.get('start_time', '06:30'), settings.get('end_time', '22:00'))
                 print(f"Loaded settings: color={current_color}, text='{custom_text}', start_time={start_time}, end_time={end_time}")
     except Exception as e:
         print(f"Error loading settings: {e}")
 
+# The JSON last written to SETTINGS_FILE
+_last_written_settings = None
+
 # Save settings to file
-def save_settings():
+def write_settings():
+    global _last_written_settings
     try:
         settings = {
             'color': current_color,
@@ -76,12 +231,47 @@ def save_settings():
             'start_time': start_time,
             'end_time': end_time
         }
-        with open(SETTINGS_FILE, 'w') as f:
-            json.dump(settings, f)
-            print(f"Saved settings: {settings}")
+        settings_json = json.dumps(settings)
+        if settings_json == _last_written_settings:
+            return  # Nothing changed, e.g. a dropdown set to its current value
+        # Write a temporary file and rename it over the old one, so readers
+        # (like matrix_effect.py) never see a half-written file, and sync it
+        # first so a power cut can't leave an empty or truncated file behind
+        tmp_file = SETTINGS_FILE + '.tmp'
+        with open(tmp_file, 'w') as f:
+            f.write(settings_json)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, SETTINGS_FILE)
+        _last_written_settings = settings_json
+        print(f"Saved settings: {settings}")
     except Exception as e:
         print(f"Error saving settings: {e}")
 
+# Settings changed since they were last written
+settings_dirty = threading.Event()
+settings_write_lock = threading.Lock()  # Keeps the writer thread and the exit flush apart
+
+def save_settings():
+    """Schedule the settings to be written by the settings writer thread"""
+    settings_dirty.set()
+
+def run_settings_writer():
+    """Write the settings whenever they change, at most once a second"""
+    while True:
+        settings_dirty.wait()
+        with settings_write_lock:
+            settings_dirty.clear()
+            write_settings()
+        time.sleep(1.0)  # Changes made meanwhile are written together
+
+def flush_settings():
+    """Write settings changed since the last write, e.g. when exiting"""
+    with settings_write_lock:
+        if settings_dirty.is_set():
+            settings_dirty.clear()
+            write_settings()
+
 # HTML template for the web interface
 HTML_TEMPLATE = """
 <!DOCTYPE html>
@@ -320,13 +510,13 @@ HTML_TEMPLATE = """
                 <div>
                     <label for="startTime">Start Time:</label><br>
                     <select id="startTime" class="time-select" onchange="updateSchedule()">
-                        <!-- Will be populated by JavaScript -->
+                        <!-- TIME_OPTIONS -->
                     </select>
                 </div>
                 <div>
                     <label for="endTime">End Time:</label><br>
                     <select id="endTime" class="time-select" onchange="updateSchedule()">
-                        <!-- Will be populated by JavaScript -->
+                        <!-- TIME_OPTIONS -->
                     </select>
                 </div>
             </div>
@@ -334,29 +524,12 @@ HTML_TEMPLATE = """
     </div>
 
     <script>
-        // Generate time options for dropdowns (30-minute intervals)
-        function generateTimeOptions() {
+        // Select the current schedule in the dropdowns (their options are
+        // filled in by the server)
+        function loadSchedule() {
             const startSelect = document.getElementById('startTime');
             const endSelect = document.getElementById('endTime');
             
-            // Clear existing options
-            startSelect.innerHTML = '';
-            endSelect.innerHTML = '';
-            
-            // Generate options for each hour and half-hour
-            for (let hour = 0; hour < 24; hour++) {
-                for (let minute of ['00', '30']) {
-                    const timeString = `${hour.toString().padStart(2, '0')}:${minute}`;
-                    const option = document.createElement('option');
-                    option.value = timeString;
-                    option.textContent = timeString;
-                    
-                    // Add to both dropdowns
-                    startSelect.appendChild(option.cloneNode(true));
-                    endSelect.appendChild(option.cloneNode(true));
-                }
-            }
-            
             // Set initial values from server
             fetch('/schedule')
                 .then(response => response.json())
@@ -444,8 +617,8 @@ HTML_TEMPLATE = """
                     document.querySelector(`input[name="color"][value="${data.color}"]`).checked = true;
                 });
                 
-            // Generate time options for dropdowns
-            generateTimeOptions();
+            // Show the current schedule in the dropdowns
+            loadSchedule();
         };
 
         // Control the animation
@@ -468,32 +641,31 @@ HTML_TEMPLATE = """
         
         // Change the animation color
         function changeColor(color) {
-            fetch('/color', {
+            // The reply isn't needed, so ask for an empty one
+            fetch('/color?noecho=1', {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
                 },
                 body: JSON.stringify({ color: color }),
             })
-            .then(response => response.json())
-            .then(data => {
-                console.log("Color changed to: " + data.color);
+            .then(() => {
+                console.log("Color changed to: " + color);
             });
         }
         
         // Update the custom text
         function updateText() {
             const text = document.getElementById('customText').value;
-            fetch('/text', {
+            fetch('/text?noecho=1', {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
                 },
                 body: JSON.stringify({ text: text }),
             })
-            .then(response => response.json())
-            .then(data => {
-                console.log("Text updated to: " + data.text);
+            .then(() => {
+                console.log("Text updated to: " + text);
             });
         }
     </script>
@@ -501,25 +673,122 @@ HTML_TEMPLATE = """
 </html>
 """
 
-def get_color_code(color_name):
-    """Convert color name to RGB tuple"""
-    if color_name == "green":
-        return "00ff00"  # Green
-    elif color_name == "red":
-        return "ff0000"  # Red
-    elif color_name == "blue":
-        return "00aaff"  # Blue (slightly cyan for better visibility)
-    elif color_name == "yellow":
-        return "ffff00"  # Yellow
-    elif color_name == "random":
-        return "random"  # Special case for random
-    else:
-        return "00ff00"  # Default to green
+# Schedule dropdown choices, every half hour
+TIME_OPTIONS = [f"{hour:02d}:{minute:02d}" for hour in range(24) for minute in (0, 30)]
+TIME_OPTIONS_HTML = ("\n" + " " * 24).join(f'<option value="{t}">{t}</option>' for t in TIME_OPTIONS)
+
+# The page only depends on the constants above, so it is built, encoded (and
+# compressed) once and served as is
+INDEX_HTML = HTML_TEMPLATE.replace("<!-- TIME_OPTIONS -->", TIME_OPTIONS_HTML).encode('utf-8')
+INDEX_HTML_GZIP = gzip.compress(INDEX_HTML, compresslevel=9)
+
+def _rgb_for(color_name):
+    """Convert color name to RGB tuple, defaulting to green"""
+    return COLOR_RGB.get(color_name, (0, 255, 0))
+
+def _matrix_color_for(color_name):
+    """Convert color name to the color argument of matrix_effect.run()"""
+    return "random" if color_name == "random" else _rgb_for(color_name)
+
+# The last formatted time, and the second it is for
+_time_text = (None, "")
 
 def draw_time_text():
     """Draw current time in HH:MM:SS format"""
-    current_time = time.strftime("%H:%M:%S")
-    return current_time
+    global _time_text
+    # Format each second once, however many times it is drawn
+    now = int(time.time())
+    if now != _time_text[0]:
+        _time_text = (now, time.strftime("%H:%M:%S", time.localtime(now)))
+    return _time_text[1]
+
+# Simple 5x7 pixel font for uppercase letters and some special characters
+FONT_PATTERNS = {
+    'A': [0x3F, 0x48, 0x48, 0x3F, 0x00],  # 00111111
+                                          # 01001000
+                                          # 01001000
+                                          # 00111111
+                                          # 00000000
+    'B': [0x7F, 0x49, 0x49, 0x36, 0x00],
+    'C': [0x3E, 0x41, 0x41, 0x22, 0x00],
+    'D': [0x7F, 0x41, 0x41, 0x3E, 0x00],
+    'E': [0x7F, 0x49, 0x49, 0x41, 0x00],
+    'F': [0x7F, 0x48, 0x48, 0x40, 0x00],
+    'G': [0x3E, 0x41, 0x49, 0x2F, 0x00],
+    'H': [0x7F, 0x08, 0x08, 0x7F, 0x00],
+    'I': [0x41, 0x7F, 0x41, 0x00, 0x00],
+    'J': [0x06, 0x01, 0x01, 0x7E, 0x00],
+    'K': [0x7F, 0x08, 0x14, 0x63, 0x00],
+    'L': [0x7F, 0x01, 0x01, 0x01, 0x00],
+    'M': [0x7F, 0x20, 0x10, 0x20, 0x7F],
+    'N': [0x7F, 0x10, 0x08, 0x04, 0x7F],
+    'O': [0x3E, 0x41, 0x41, 0x3E, 0x00],
+    'P': [0x7F, 0x48, 0x48, 0x30, 0x00],
+    'Q': [0x3E, 0x41, 0x45, 0x3F, 0x00],
+    'R': [0x7F, 0x48, 0x4C, 0x33, 0x00],
+    'S': [0x32, 0x49, 0x49, 0x26, 0x00],
+    'T': [0x40, 0x40, 0x7F, 0x40, 0x40],
+    'U': [0x7E, 0x01, 0x01, 0x7E, 0x00],
+    'V': [0x7C, 0x02, 0x01, 0x02, 0x7C],
+    'W': [0x7F, 0x02, 0x04, 0x02, 0x7F],
+    'X': [0x63, 0x14, 0x08, 0x14, 0x63],
+    'Y': [0x70, 0x08, 0x07, 0x08, 0x70],
+    'Z': [0x43, 0x45, 0x49, 0x51, 0x61],
+    ' ': [0x00, 0x00, 0x00, 0x00, 0x00],
+    '.': [0x01, 0x01, 0x00, 0x00, 0x00],
+    ',': [0x01, 0x02, 0x00, 0x00, 0x00],
+    ':': [0x14, 0x14, 0x00, 0x00, 0x00],
+    '!': [0x7D, 0x00, 0x00, 0x00, 0x00],
+    '?': [0x20, 0x40, 0x45, 0x38, 0x00],
+    '(': [0x3E, 0x41, 0x00, 0x00, 0x00],
+    ')': [0x41, 0x3E, 0x00, 0x00, 0x00],
+    '+': [0x08, 0x08, 0x3E, 0x08, 0x08],
+    '-': [0x08, 0x08, 0x08, 0x08, 0x00],
+    '/': [0x01, 0x02, 0x04, 0x08, 0x10],
+    '\\': [0x10, 0x08, 0x04, 0x02, 0x01],
+    '0': [0x3E, 0x45, 0x49, 0x51, 0x3E],
+    '1': [0x00, 0x21, 0x7F, 0x01, 0x00],
+    '2': [0x21, 0x43, 0x45, 0x49, 0x31],
+    '3': [0x22, 0x41, 0x49, 0x49, 0x36],
+    '4': [0x0C, 0x14, 0x24, 0x7F, 0x04],
+    '5': [0x72, 0x51, 0x51, 0x51, 0x4E],
+    '6': [0x1E, 0x29, 0x49, 0x49, 0x06],
+    '7': [0x40, 0x40, 0x47, 0x58, 0x60],
+    '8': [0x36, 0x49, 0x49, 0x49, 0x36],
+    '9': [0x30, 0x49, 0x49, 0x4A, 0x3C],
+}
+
+# The same font as a bitmap: FONT[ord(char)][row, col] is True where the
+# character's pixel is lit
+FONT = np.zeros((128, 7, 5), dtype=bool)
+for _char, _pattern in FONT_PATTERNS.items():
+    for _col, _bits in enumerate(_pattern):
+        for _row in range(7):
+            FONT[ord(_char), _row, _col] = bool(_bits & (1 << (6 - _row)))  # Flip vertically
+
+@functools.lru_cache(maxsize=256)
+def text_bitmap(line):
+    """Lay out a line of FONT characters, 6 pixels apart, as one (7, 6 * len(line)) bitmap
+
+    Cached, since the same lines are redrawn every second; the bitmap is read-only.
+    """
+    # Characters missing from the font are left blank, like spaces
+    codes = [ord(char) if char in FONT_PATTERNS else ord(' ') for char in line]
+    glyphs = np.pad(FONT[codes], ((0, 0), (0, 0), (0, 1)))  # One blank column between characters
+    bitmap = glyphs.transpose(1, 0, 2).reshape(7, -1)
+    bitmap.setflags(write=False)
+    return bitmap
+
+def draw_bitmap(bitmap_ft, bitmap, x, y, color):
+    """Draw the lit pixels of a bitmap with its top left corner at (x, y), clipped to the display"""
+    height, width = bitmap.shape
+    x0, y0 = max(x, 0), max(y, 0)
+    x1, y1 = min(x + width, bitmap_ft.width), min(y + height, bitmap_ft.height)
+    if x0 >= x1 or y0 >= y1:
+        return
+    lit = bitmap[y0 - y:y1 - y, x0 - x:x1 - x]
+    bitmap_ft.data[y0:y1, x0:x1][lit] = color
+    bitmap_ft.mark_dirty(np.arange(x0, x1))
 
 def draw_text(text, color=(0, 255, 0), layer=None, clear_first=True):
     """Draw text on the display"""
@@ -529,68 +798,17 @@ def draw_text(text, color=(0, 255, 0), layer=None, clear_first=True):
     if layer is None:
         layer = DISPLAY_TEXT_LAYER
     
-    # Create a new FlaschenNP instance for the text layer
-    text_ft = flaschen_np.FlaschenNP(FT_HOST, FT_PORT, DISPLAY_WIDTH, DISPLAY_HEIGHT, layer)
+    # Reuse the display connection for the text layer
+    text_ft = _get_ft(layer)
     
     if clear_first:
-        # Clear just the text layer if not drawing multiple lines
-        text_ft.zero()
-    
-    # Simple 5x7 pixel font for uppercase letters and some special characters
-    font = {
-        'A': [0x3F, 0x48, 0x48, 0x3F, 0x00],  # 00111111
-                                              # 01001000
-                                              # 01001000
-                                              # 00111111
-                                              # 00000000
-        'B': [0x7F, 0x49, 0x49, 0x36, 0x00],
-        'C': [0x3E, 0x41, 0x41, 0x22, 0x00],
-        'D': [0x7F, 0x41, 0x41, 0x3E, 0x00],
-        'E': [0x7F, 0x49, 0x49, 0x41, 0x00],
-        'F': [0x7F, 0x48, 0x48, 0x40, 0x00],
-        'G': [0x3E, 0x41, 0x49, 0x2F, 0x00],
-        'H': [0x7F, 0x08, 0x08, 0x7F, 0x00],
-        'I': [0x41, 0x7F, 0x41, 0x00, 0x00],
-        'J': [0x06, 0x01, 0x01, 0x7E, 0x00],
-        'K': [0x7F, 0x08, 0x14, 0x63, 0x00],
-        'L': [0x7F, 0x01, 0x01, 0x01, 0x00],
-        'M': [0x7F, 0x20, 0x10, 0x20, 0x7F],
-        'N': [0x7F, 0x10, 0x08, 0x04, 0x7F],
-        'O': [0x3E, 0x41, 0x41, 0x3E, 0x00],
-        'P': [0x7F, 0x48, 0x48, 0x30, 0x00],
-        'Q': [0x3E, 0x41, 0x45, 0x3F, 0x00],
-        'R': [0x7F, 0x48, 0x4C, 0x33, 0x00],
-        'S': [0x32, 0x49, 0x49, 0x26, 0x00],
-        'T': [0x40, 0x40, 0x7F, 0x40, 0x40],
-        'U': [0x7E, 0x01, 0x01, 0x7E, 0x00],
-        'V': [0x7C, 0x02, 0x01, 0x02, 0x7C],
-        'W': [0x7F, 0x02, 0x04, 0x02, 0x7F],
-        'X': [0x63, 0x14, 0x08, 0x14, 0x63],
-        'Y': [0x70, 0x08, 0x07, 0x08, 0x70],
-        'Z': [0x43, 0x45, 0x49, 0x51, 0x61],
-        ' ': [0x00, 0x00, 0x00, 0x00, 0x00],
-        '.': [0x01, 0x01, 0x00, 0x00, 0x00],
-        ',': [0x01, 0x02, 0x00, 0x00, 0x00],
-        ':': [0x14, 0x14, 0x00, 0x00, 0x00],
-        '!': [0x7D, 0x00, 0x00, 0x00, 0x00],
-        '?': [0x20, 0x40, 0x45, 0x38, 0x00],
-        '(': [0x3E, 0x41, 0x00, 0x00, 0x00],
-        ')': [0x41, 0x3E, 0x00, 0x00, 0x00],
-        '+': [0x08, 0x08, 0x3E, 0x08, 0x08],
-        '-': [0x08, 0x08, 0x08, 0x08, 0x00],
-        '/': [0x01, 0x02, 0x04, 0x08, 0x10],
-        '\\': [0x10, 0x08, 0x04, 0x02, 0x01],
-        '0': [0x3E, 0x45, 0x49, 0x51, 0x3E],
-        '1': [0x00, 0x21, 0x7F, 0x01, 0x00],
-        '2': [0x21, 0x43, 0x45, 0x49, 0x31],
-        '3': [0x22, 0x41, 0x49, 0x49, 0x36],
-        '4': [0x0C, 0x14, 0x24, 0x7F, 0x04],
-        '5': [0x72, 0x51, 0x51, 0x51, 0x4E],
-        '6': [0x1E, 0x29, 0x49, 0x49, 0x06],
-        '7': [0x40, 0x40, 0x47, 0x58, 0x60],
-        '8': [0x36, 0x49, 0x49, 0x49, 0x36],
-        '9': [0x30, 0x49, 0x49, 0x4A, 0x3C],
-    }
+        # Clear just the text layer if not drawing multiple lines; only the
+        # columns drawn since the last clear can be lit
+        text_ft.zero_dirty()
+    
+    if tuple(color) == (0, 0, 0) and not text_ft.transparent:
+        color = (1, 1, 1)  # Black is drawn as (1, 1, 1), as FlaschenNP.set() does
+    
     
     # Add current time to text
     if text.strip():
@@ -623,19 +841,9 @@ def draw_text(text, color=(0, 255, 0), layer=None, clear_first=True):
         # Current Y position for this line
         current_y = start_y + i * line_spacing
         
-        # Draw the line of text
-        x = start_x
-        for char in line:
-            if char in font:
-                # Draw the character (no scaling)
-                pattern = font[char]
-                for col in range(5):
-                    bits = pattern[col]
-                    for row in range(7):
-                        if bits & (1 << (6 - row)):  # Flip vertically
-                            # Draw a single pixel (normal size)
-                            text_ft.set(x + col, current_y + row, color)
-            x += char_width
+        # Draw the whole line of text at once (no scaling)
+        if line:
+            draw_bitmap(text_ft, text_bitmap(line), start_x, current_y, color)
     
     # Send to display
     text_ft.send()
@@ -653,45 +861,60 @@ def fill_screen(color, layer=None):
     if layer is None:
         layer = DISPLAY_LAYER
     
-    fill_ft = flaschen_np.FlaschenNP(FT_HOST, FT_PORT, DISPLAY_WIDTH, DISPLAY_HEIGHT, layer)
-    
-    for y in range(DISPLAY_HEIGHT):
-        for x in range(DISPLAY_WIDTH):
-            fill_ft.set(x, y, color)
+    fill_ft = _get_ft(layer)
+    fill_ft.fill(color)
     fill_ft.send()
 
+def clear_all_layers():
+    """Blank the animation, text and QR code layers"""
+    # The QR code shares the animation layer, so send each layer only once
+    for layer in dict.fromkeys((DISPLAY_LAYER, DISPLAY_TEXT_LAYER, QR_CODE_LAYER)):
+        fill_screen((0, 0, 0), layer=layer)
+
+# What was last drawn for the clock thread, and when
+_last_time_display = (None, 0.0)
+
+def _time_display_key():
+    """What update_time_display() would draw in the current state"""
+    if animation_state in ["Running", "Paused"] and custom_text.strip():
+        return (animation_state, custom_text, current_color, draw_time_text())
+    return (animation_state,)
+
+def mark_display_drawn():
+    """Note that the display was just drawn for the current state, so the clock thread only refreshes it"""
+    global _last_time_display
+    _last_time_display = (_time_display_key(), time.monotonic())
+
+@with_state_lock
 def update_time_display():
     """Updates time display without affecting main text"""
-    global custom_text, animation_state, current_color
+    global custom_text, animation_state, current_color, _last_time_display
+    
+    # Skip the redraw when it would send the same frames again, but still
+    # resend now and then, as the display server drops layers that go quiet
+    display_key = _time_display_key()
+    now = time.monotonic()
+    last_key, last_drawn = _last_time_display
+    if display_key == last_key and now - last_drawn < DISPLAY_REFRESH_INTERVAL:
+        return
+    _last_time_display = (display_key, now)
     
     if animation_state == "Stopped":
         # Just update the welcome text with current time
         draw_welcome_text()
     elif animation_state in ["Running", "Paused"] and custom_text.strip():
         # Determine color based on current setting
-        color_rgb = (0, 255, 0)  # Default green
-        if current_color == "red":
-            color_rgb = (255, 0, 0)
-        elif current_color == "blue":
-            color_rgb = (0, 170, 255)
-        elif current_color == "yellow":
-            color_rgb = (255, 255, 0)
+        color_rgb = _rgb_for(current_color)
             
         # Update the text with the current time
         draw_text(custom_text, color=color_rgb)
     elif animation_state == "Blank":
         # In blank mode, ensure the screen stays blank
-        fill_screen((0, 0, 0))
-        fill_screen((0, 0, 0), layer=DISPLAY_TEXT_LAYER)
-        fill_screen((0, 0, 0), layer=QR_CODE_LAYER)
+        clear_all_layers()
 
 def run_matrix_animation():
     """Run the matrix animation in a separate thread"""
-    global matrix_process, animation_paused, stop_event, animation_state, current_color, color_change_event, custom_text
-    
-    # Text display thread reference
-    text_thread = None
-    text_thread_stop = threading.Event()
+    global stop_event, animation_state, current_color, color_change_event, custom_text
     
     # Clock update thread
     clock_thread_stop = threading.Event()
@@ -699,247 +922,244 @@ def run_matrix_animation():
     # Function for clock thread
     def clock_update_thread():
         """Thread to update the clock display"""
-        while not clock_thread_stop.is_set():
-            update_time_display()
-            time.sleep(1)  # Update every second
+        while True:
+            with state_lock:
+                # Checked under the lock, so nothing is drawn after the shutdown clear
+                if clock_thread_stop.is_set():
+                    break
+                update_time_display()
+            # Sleep until the next second starts, or until woken by a state change
+            ready, _, _ = select.select([clock_wake_r], [], [], 1.0 - time.time() % 1.0)
+            if ready:
+                os.read(clock_wake_r, 4096)
     
     # Start the clock update thread
     clock_thread = threading.Thread(target=clock_update_thread)
     clock_thread.daemon = True
     clock_thread.start()
     
-    # Skip initial welcome text as it's already drawn in main thread
-    initial_startup = True
+    seen_version = state_version
     
-    while not stop_event.is_set():
-        if animation_state == "Running":
-            # Get color parameter
-            color_param = get_color_code(current_color)
-            
-            # Command to start the matrix effect
-            cmd = [
-                "python", "matrix_effect.py",
-                "--width", str(DISPLAY_WIDTH),
-                "--height", str(DISPLAY_HEIGHT),
-                "--layer", str(DISPLAY_LAYER)
-            ]
-            
-            # Add color parameter if not random
-            if color_param != "random":
-                cmd.extend(["--color", color_param])
-            else:
-                cmd.extend(["--color", "random"])
-            
-            # If animation should be running but isn't, start it
-            if matrix_process is None or matrix_process.poll() is not None:
-                matrix_process = subprocess.Popen(cmd)
-                # Clear the color change event since we're starting fresh
-                color_change_event.clear()
+    # Holds state_lock except while waiting for a change
+    with state_changed:
+        while not stop_event.is_set():
+            if animation_state == "Running":
+                # If animation should be running but isn't, start it
+                if not animation_running():
+                    start_animation()
+                    # Clear the color change event since we're starting fresh
+                    color_change_event.clear()
                 
-                # If there's custom text, display it overlay after a short delay
-                if custom_text and custom_text.strip() != "":
-                    # Wait a moment for the matrix to initialize
-                    time.sleep(0.5)
-                    # Display the text overlay
-                    color_rgb = (0, 255, 0)  # Default green
-                    if current_color == "red":
-                        color_rgb = (255, 0, 0)
-                    elif current_color == "blue":
-                        color_rgb = (0, 170, 255)
-                    elif current_color == "yellow":
-                        color_rgb = (255, 255, 0)
+                    # If there's custom text, display it overlay
+                    if custom_text and custom_text.strip() != "":
+                        # Display the text overlay; it has its own layer, so
+                        # there's no need to wait for the animation's first frame
+                        color_rgb = _rgb_for(current_color)
                     
-                    # Stop any existing text thread
-                    if text_thread and text_thread.is_alive():
-                        text_thread_stop.set()
-                        text_thread.join(timeout=1.0)
-                    
-                    # Create thread stop event
-                    text_thread_stop = threading.Event()
-                    
-                    # Draw custom text only once on the background layer
-                    draw_text(custom_text, color=color_rgb)
-        elif animation_state == "Paused":
-            # If paused and process is running, just leave it (will be frozen by signal)
-            pass
-        elif animation_state == "Stopped":
-            # If stopped and process is running, terminate it
-            if matrix_process and matrix_process.poll() is None:
-                matrix_process.terminate()
-                matrix_process.wait()
-                matrix_process = None
-                
-            # Always display welcome text when stopped (but skip if it's the initial startup)
-            if not initial_startup:
-                draw_welcome_text()
-        elif animation_state == "Blank":
-            # If in blank mode and process is running, terminate it
-            if matrix_process and matrix_process.poll() is None:
-                matrix_process.terminate()
-                matrix_process.wait()
-                matrix_process = None
-            
-            # Ensure the screen is blank
-            fill_screen((0, 0, 0))
-            fill_screen((0, 0, 0), layer=DISPLAY_TEXT_LAYER)
-            fill_screen((0, 0, 0), layer=QR_CODE_LAYER)
-        
-        # After first loop, we're no longer in initial startup
-        initial_startup = False
+                        # Draw custom text only once on the background layer
+                        draw_text(custom_text, color=color_rgb)
+            elif animation_state == "Paused":
+                # If paused and the animation is running, just leave it (frozen by matrix_pause)
+                pass
+            elif animation_state in ["Stopped", "Blank"]:
+                # If the animation is still running, stop it; whatever switched
+                # to this state has drawn it, and the clock thread keeps it up
+                stop_animation()
         
-        # If color has changed, we don't need to restart the process, new raindrops will use the new color
-        if color_change_event.is_set():
-            color_change_event.clear()
+            # If color has changed, we don't need to restart the animation, new raindrops will use the new color
+            if color_change_event.is_set():
+                color_change_event.clear()
             
-            # If there's custom text and we're running, update the text color
-            if custom_text and custom_text.strip() != "" and animation_state in ["Running", "Paused"]:
-                color_rgb = (0, 255, 0)  # Default green
-                if current_color == "red":
-                    color_rgb = (255, 0, 0)
-                elif current_color == "blue":
-                    color_rgb = (0, 170, 255)
-                elif current_color == "yellow":
-                    color_rgb = (255, 255, 0)
+                # If there's custom text and we're running, update the text color
+                if custom_text and custom_text.strip() != "" and animation_state in ["Running", "Paused"]:
+                    color_rgb = _rgb_for(current_color)
                     
-                # Update the text with the new color
-                draw_text(custom_text, color=color_rgb)
+                    # Update the text with the new color
+                    draw_text(custom_text, color=color_rgb)
         
-        time.sleep(0.5)
+            # Sleep until something changes; the timeout still restarts the
+            # animation promptly if it exits on its own
+            state_changed.wait_for(lambda: stop_event.is_set() or state_version != seen_version,
+                                   timeout=1.0)
+            seen_version = state_version
     
-    # Ensure the process is stopped when exiting
-    if matrix_process and matrix_process.poll() is None:
-        matrix_process.terminate()
-        matrix_process.wait()
-        matrix_process = None
+        # Ensure the animation is stopped when exiting
+        stop_animation()
+        
+        # Clear the display
+        clear_all_layers()
+        
+        # Stop clock thread when exiting
+        clock_thread_stop.set()
     
-    # Clear the display
-    fill_screen((0, 0, 0))
-    fill_screen((0, 0, 0), layer=DISPLAY_TEXT_LAYER)
-
-    # Stop clock thread when exiting
-    clock_thread_stop.set()
+    wake_clock()
     if clock_thread.is_alive():
         clock_thread.join(timeout=1.0)
 
 @app.route('/')
 def index():
     """Serve the main web interface"""
-    return render_template_string(HTML_TEMPLATE)
+    headers = {'Cache-Control': 'public, max-age=3600', 'Vary': 'Accept-Encoding'}
+    if request.accept_encodings['gzip'] > 0:
+        headers['Content-Encoding'] = 'gzip'
+        return Response(INDEX_HTML_GZIP, mimetype='text/html', headers=headers)
+    return Response(INDEX_HTML, mimetype='text/html', headers=headers)
+
+def body_json():
+    """Parse the request's JSON body, without keeping a copy of the raw body"""
+    return request.get_json(cache=False)
+
+def echo_json(payload):
+    """Return payload as JSON, or an empty 204 response if the client asked for none (?noecho=1)"""
+    if request.args.get('noecho') == '1':
+        return Response(status=204)
+    return jsonify(payload)
+
+def conditional_json(body, etag):
+    """Return a JSON body tagged with etag, or 304 Not Modified if the browser already has it"""
+    response = Response(body, mimetype='application/json',
+                        headers={'Cache-Control': 'no-cache'})
+    response.set_etag(etag)
+    return response.make_conditional(request)
+
+# Last /status response: the state it was built from, its JSON body and ETag
+_status_cache = (None, None, None)
 
 @app.route('/status')
+@with_state_lock
 def get_status():
     """Return the current animation status and color"""
-    global animation_state, current_color, custom_text
-    return jsonify({"status": animation_state, "color": current_color, "text": custom_text})
+    global animation_state, current_color, custom_text, _status_cache
+    state = (animation_state, current_color, custom_text)
+    cached_state, body, etag = _status_cache
+    if state != cached_state:
+        # Only serialize again when the state has changed
+        body = app.json.dumps({"status": state[0], "color": state[1], "text": state[2]}).encode('utf-8')
+        etag = hashlib.md5(body).hexdigest()
+        _status_cache = (state, body, etag)
+    return conditional_json(body, etag)
 
 @app.route('/color', methods=['POST'])
+@with_state_lock
 def change_color():
     """Change the matrix color"""
-    global current_color, animation_state, matrix_process, color_change_event
+    global current_color, animation_state, color_change_event
     
     # Get the new color from the request
-    new_color = request.json.get('color', 'green')
+    new_color = body_json().get('color', 'green')
+    if not isinstance(new_color, str) or (new_color not in COLOR_RGB and new_color != "random"):
+        return jsonify({
+            "color": current_color,
+            "error": "Unknown color"
+        }), 400
     current_color = new_color
+    # The running animation picks this up for its next raindrops
+    matrix_color[0] = _matrix_color_for(current_color)
     
     # Save the updated settings
     save_settings()
     
     # Set the color change event to notify the animation thread
     color_change_event.set()
+    notify_state_change()
     
     # Don't restart the animation when color changes
     # The color changes will affect newly spawned raindrops
     
-    return jsonify({"color": current_color})
+    return echo_json({"color": current_color})
 
-@app.route('/control', methods=['POST'])
-def control_animation():
-    """Handle animation control commands"""
-    global matrix_process, animation_state
-    action = request.json.get('action')
-    
-    # Handle blank mode action - this should work regardless of schedule
-    if action == 'blank':
-        # Stop any running animation
-        if matrix_process and matrix_process.poll() is None:
-            matrix_process.terminate()
-            matrix_process.wait()
-            matrix_process = None
-        
-        # Set to blank mode
-        animation_state = "Blank"
-        # Clear the display
-        fill_screen((0, 0, 0))
-        fill_screen((0, 0, 0), layer=DISPLAY_TEXT_LAYER)
-        fill_screen((0, 0, 0), layer=QR_CODE_LAYER)
-        return jsonify({"status": animation_state})
+def blank_action():
+    """Blank the display - this should work regardless of schedule"""
+    global animation_state
+    # Stop any running animation
+    stop_animation()
     
+    # Set to blank mode
+    animation_state = "Blank"
+    # Clear the display
+    clear_all_layers()
+    mark_display_drawn()
+
+def start_action():
+    """Start or resume the animation; returns an error message if not allowed"""
+    global animation_state
     # Don't allow starting from blank mode unless it's during active hours
-    current_time = time.strftime("%H:%M")
-    if action == 'start' and animation_state == "Blank":
-        if start_time <= current_time < end_time:
+    if animation_state == "Blank":
+        if in_active_hours():
             # During active hours, allow starting from blank mode
             animation_state = "Running"  # Changed from "Stopped" to "Running" to start animation immediately
             # Clear the display
-            fill_screen((0, 0, 0))
-            fill_screen((0, 0, 0), layer=DISPLAY_TEXT_LAYER)
-            fill_screen((0, 0, 0), layer=QR_CODE_LAYER)
+            clear_all_layers()
         else:
             # Outside active hours, don't allow starting
-            return jsonify({"status": animation_state, "error": "Cannot start during off hours"})
-    
-    if action == 'start':
-        if animation_state == "Paused":
-            # Resume from pause (send SIGCONT to resume the process)
-            if matrix_process and matrix_process.poll() is None:
-                os.kill(matrix_process.pid, signal.SIGCONT)
-        elif animation_state == "Stopped":
-            # Start fresh
-            if matrix_process and matrix_process.poll() is None:
-                matrix_process.terminate()
-                matrix_process.wait()
-                matrix_process = None
-        
-        animation_state = "Running"
+            return "Cannot start during off hours"
     
-    elif action == 'pause':
-        if animation_state == "Running":
-            # Instead of terminating the process, just send SIGSTOP to freeze it
-            if matrix_process and matrix_process.poll() is None:
-                os.kill(matrix_process.pid, signal.SIGSTOP)
-            
-            animation_state = "Paused"
-    
-    elif action == 'stop':
-        # Stop the animation regardless of current state
-        if matrix_process and matrix_process.poll() is None:
-            matrix_process.terminate()
-            matrix_process.wait()
-            matrix_process = None
+    if animation_state == "Paused":
+        # Resume from pause
+        matrix_pause.clear()
+    elif animation_state == "Stopped":
+        # Start fresh
+        stop_animation()
+    
+    animation_state = "Running"
+
+def pause_action():
+    """Freeze the running animation"""
+    global animation_state
+    if animation_state == "Running":
+        # Instead of stopping the animation, just freeze it
+        matrix_pause.set()
         
-        # Check if we're in off hours
-        current_time = time.strftime("%H:%M")
-        if start_time <= current_time < end_time:
-            # During active hours, show welcome text
-            draw_welcome_text()
-            animation_state = "Stopped"
-        else:
-            # Outside active hours, go to blank mode
-            fill_screen((0, 0, 0))
-            fill_screen((0, 0, 0), layer=DISPLAY_TEXT_LAYER)
-            fill_screen((0, 0, 0), layer=QR_CODE_LAYER)
-            animation_state = "Blank"
+        animation_state = "Paused"
+
+def stop_action():
+    """Stop the animation, showing the QR code or blanking the display depending on the time"""
+    global animation_state
+    # Stop the animation regardless of current state
+    stop_animation()
     
-    return jsonify({"status": animation_state})
+    # Check if we're in off hours
+    if in_active_hours():
+        # During active hours, show welcome text
+        draw_welcome_text()
+        animation_state = "Stopped"
+    else:
+        # Outside active hours, go to blank mode
+        clear_all_layers()
+        animation_state = "Blank"
+    mark_display_drawn()
+
+# Handlers for each /control action
+CONTROL_ACTIONS = {
+    'blank': blank_action,
+    'start': start_action,
+    'pause': pause_action,
+    'stop': stop_action,
+}
+
+@app.route('/control', methods=['POST'])
+@with_state_lock
+def control_animation():
+    """Handle animation control commands"""
+    action = body_json().get('action')
+    
+    handler = CONTROL_ACTIONS.get(action)
+    error = handler() if handler else None
+    notify_state_change()
+    if error:
+        return jsonify({"status": animation_state, "error": error})
+    return echo_json({"status": animation_state})
 
 @app.route('/text', methods=['POST'])
+@with_state_lock
 def update_text():
     """Update the text overlay"""
-    global custom_text, animation_state, matrix_process
+    global custom_text, animation_state
     
     # Get the new text from the request
-    new_text = request.json.get('text', '')
+    new_text = body_json().get('text', '')
     custom_text = new_text
+    notify_state_change()
     
     # Save the updated settings
     save_settings()
@@ -947,27 +1167,23 @@ def update_text():
     # If the animation is running or paused, update the text display
     if animation_state in ["Running", "Paused"] and custom_text.strip():
         # Determine color based on current setting
-        color_rgb = (0, 255, 0)  # Default green
-        if current_color == "red":
-            color_rgb = (255, 0, 0)
-        elif current_color == "blue":
-            color_rgb = (0, 170, 255)
-        elif current_color == "yellow":
-            color_rgb = (255, 255, 0)
+        color_rgb = _rgb_for(current_color)
             
         # Update the text with the new content
         draw_text(custom_text, color=color_rgb)
     elif animation_state == "Stopped":
         # In stopped state, always show welcome text regardless of custom text
         draw_welcome_text()
+        mark_display_drawn()
     
-    return jsonify({"text": custom_text})
+    return echo_json({"text": custom_text})
 
 @app.route('/qrcode', methods=['POST'])
+@with_state_lock
 def qrcode_control():
     """Show QR code on LED matrix"""
     # Parse the request
-    data = request.json
+    data = body_json()
     action = data.get('action', '')
     
     if action == 'show':
@@ -986,32 +1202,26 @@ def qrcode_control():
     })
 
 @app.route('/schedule', methods=['GET', 'POST'])
+@with_state_lock
 def handle_schedule():
     """Handle schedule settings"""
     global start_time, end_time
     
     if request.method == 'GET':
         # Return current schedule settings
-        return jsonify({
-            "start_time": start_time,
-            "end_time": end_time
-        })
+        body = app.json.dumps({"start_time": start_time, "end_time": end_time}).encode('utf-8')
+        return conditional_json(body, hashlib.md5(body).hexdigest())
     
     elif request.method == 'POST':
         # Update schedule settings
-        data = request.json
+        data = body_json()
         new_start_time = data.get('start_time', start_time)
         new_end_time = data.get('end_time', end_time)
         
         # Validate times
         try:
-            # Check if times are in correct format (HH:MM)
-            time.strptime(new_start_time, "%H:%M")
-            time.strptime(new_end_time, "%H:%M")
-            
-            # Update settings
-            start_time = new_start_time
-            end_time = new_end_time
+            # Update settings, if times are in correct format (HH:MM)
+            set_schedule(new_start_time, new_end_time)
             
             # Save to file
             save_settings()
@@ -1021,7 +1231,7 @@ def handle_schedule():
                 "start_time": start_time,
                 "end_time": end_time
             })
-        except ValueError:
+        except (ValueError, TypeError):
             return jsonify({
                 "success": False,
                 "error": "Invalid time format. Use HH:MM"
@@ -1029,21 +1239,25 @@ def handle_schedule():
 
 def signal_handler(sig, frame):
     """Handle SIGINT and SIGTERM signals"""
-    stop_event.set()
-    if matrix_process and matrix_process.poll() is None:
-        matrix_process.terminate()
-        try:
-            matrix_process.wait(timeout=2)
-        except subprocess.TimeoutExpired:
-            matrix_process.kill()
+    with state_lock:
+        stop_event.set()
+        notify_state_change()
+        stop_animation()
+    # Let the animation control thread clear the display and stop the clock
+    if animation_thread is not None:
+        animation_thread.join(timeout=ANIMATION_STOP_TIMEOUT)
     print("\nShutting down web server...")
     # Don't use os._exit as it doesn't allow cleanup
     # Instead let the normal exit flow handle things
     if sig == signal.SIGTERM:
         sys.exit(0)
 
+@functools.lru_cache(maxsize=None)
 def generate_qr_code(url):
-    """Generate a QR code for the given URL"""
+    """Generate a QR code for the given URL, as a read-only boolean matrix
+
+    Cached, as encoding is the slow part and the URL doesn't change.
+    """
     qr = qrcode.QRCode(
         version=1,
         error_correction=qrcode.constants.ERROR_CORRECT_L,
@@ -1054,35 +1268,33 @@ def generate_qr_code(url):
     qr.make(fit=True)
     
     # Get the QR code matrix
-    matrix = qr.get_matrix()
+    matrix = np.asarray(qr.get_matrix(), dtype=bool)
+    matrix.setflags(write=False)
     return matrix
 
+# Frames drawn by display_qr_code(), by URL
+_qr_frames = {}
+
 def display_qr_code():
     """Display a QR code for the web server URL on the LED matrix"""
-    # Define the simple 5x7 font for IP address display
-    font = {
-        '0': [0x3E, 0x45, 0x49, 0x51, 0x3E],
-        '1': [0x00, 0x21, 0x7F, 0x01, 0x00],
-        '2': [0x21, 0x43, 0x45, 0x49, 0x31],
-        '3': [0x22, 0x41, 0x49, 0x49, 0x36],
-        '4': [0x0C, 0x14, 0x24, 0x7F, 0x04],
-        '5': [0x72, 0x51, 0x51, 0x51, 0x4E],
-        '6': [0x1E, 0x29, 0x49, 0x49, 0x06],
-        '7': [0x40, 0x40, 0x47, 0x58, 0x60],
-        '8': [0x36, 0x49, 0x49, 0x49, 0x36],
-        '9': [0x30, 0x49, 0x49, 0x4A, 0x3C],
-        '.': [0x01, 0x01, 0x00, 0x00, 0x00],
-    }
-
     # Use the actual IP address instead of the hostname lookup
-    ip_address = "192.168.86.56"
-    url = f"http://{ip_address}:{PORT}"
+    ip_address = SERVER_ADDRESS
+    url = SERVER_URL
+    
+    # Reuse the display connection for the QR code layer
+    qr_ft = _get_ft(QR_CODE_LAYER)
+    
+    frame = _qr_frames.get(url)
+    if frame is not None:
+        # The URL never changes while running, so resend the frame drawn the first time
+        qr_ft.data[:] = frame
+        qr_ft.mark_dirty(np.arange(qr_ft.width))
+        qr_ft.send()
+        return url
     
     # Generate the QR code
     qr_matrix = generate_qr_code(url)
     
-    # Create a new FlaschenNP instance for the QR code layer
-    qr_ft = flaschen_np.FlaschenNP(FT_HOST, FT_PORT, DISPLAY_WIDTH, DISPLAY_HEIGHT, layer=QR_CODE_LAYER)
     qr_ft.zero()
     
     # Scale factor for the QR code (3x larger)
@@ -1095,14 +1307,10 @@ def display_qr_code():
     # Position slightly higher to leave room for IP text
     start_y = (DISPLAY_HEIGHT - scaled_size) // 2 + 10
     
-    # Draw the QR code with scaling
-    for y in range(qr_size):
-        for x in range(qr_size):
-            color = (0, 0, 0) if qr_matrix[y][x] else (255, 255, 255)  # Black or white
-            # Draw each QR code pixel as a 3x3 square
-            for sy in range(scale):
-                for sx in range(scale):
-                    qr_ft.set(start_x + (x * scale) + sx, start_y + (y * scale) + sy, color)
+    # Draw the QR code with scaling, each QR code pixel as a 3x3 square
+    dark = qr_matrix.repeat(scale, axis=0).repeat(scale, axis=1)
+    draw_bitmap(qr_ft, dark, start_x, start_y, (1, 1, 1))  # Black, which set() draws as (1, 1, 1)
+    draw_bitmap(qr_ft, ~dark, start_x, start_y, (255, 255, 255))
     
     # Draw the IP address above the QR code
     text = f"{ip_address}"
@@ -1110,15 +1318,9 @@ def display_qr_code():
     text_x = (DISPLAY_WIDTH - text_width) // 2
     text_y = start_y - 15
     
-    # Simple font rendering for the IP address only
-    for i, char in enumerate(text):
-        if char in font:
-            pattern = font[char]
-            for col in range(5):
-                bits = pattern[col]
-                for row in range(7):
-                    if bits & (1 << (6 - row)):
-                        qr_ft.set(text_x + i*6 + col, text_y + row, (0, 255, 0))
+    # Draw the IP address with the 5x7 font, as one bitmap
+    draw_bitmap(qr_ft, text_bitmap(text), text_x, text_y, (0, 255, 0))
+    _qr_frames[url] = qr_ft.data.copy()
     
     # Send to display
     qr_ft.send()
@@ -1128,41 +1330,45 @@ def display_qr_code():
 
 def run_scheduler():
     """Run the scheduler to automatically change modes based on time"""
-    global animation_state, scheduler_stop_event
+    global animation_state
     
-    while not scheduler_stop_event.is_set():
-        current_time = time.strftime("%H:%M")
-        
-        # Check if current time is between start_time and end_time
-        if start_time <= current_time < end_time:
-            # During active hours, ensure we're not in blank mode
-            if animation_state == "Blank":
-                # If we were in blank mode, go to stopped state
-                animation_state = "Stopped"
-                # Clear the display
-                fill_screen((0, 0, 0))
-                fill_screen((0, 0, 0), layer=DISPLAY_TEXT_LAYER)
-                fill_screen((0, 0, 0), layer=QR_CODE_LAYER)
-                # Show QR code
-                display_qr_code()
-        else:
-            # Outside active hours, ensure we're in blank mode
-            if animation_state != "Blank":
-                # Stop any running animation
-                if matrix_process and matrix_process.poll() is None:
-                    matrix_process.terminate()
-                    matrix_process.wait()
-                    matrix_process = None
+    was_active = None  # Whether the last check was within the active hours
+    while True:
+        with state_lock:
+            # Check if current time is between start_time and end_time
+            active = in_active_hours()
+            if active == was_active:
+                # Only act when the active hours start or end (or on the first
+                # check), so a mode chosen by hand lasts until then
+                pass
+            elif active:
+                # During active hours, ensure we're not in blank mode
+                if animation_state == "Blank":
+                    # If we were in blank mode, go to stopped state
+                    animation_state = "Stopped"
+                    # Clear the display
+                    clear_all_layers()
+                    # Show QR code
+                    display_qr_code()
+                    mark_display_drawn()
+                    notify_state_change()
+            else:
+                # Outside active hours, ensure we're in blank mode
+                if animation_state != "Blank":
+                    # Stop any running animation
+                    stop_animation()
                 
-                # Set to blank mode
-                animation_state = "Blank"
-                # Clear the display
-                fill_screen((0, 0, 0))
-                fill_screen((0, 0, 0), layer=DISPLAY_TEXT_LAYER)
-                fill_screen((0, 0, 0), layer=QR_CODE_LAYER)
+                    # Set to blank mode
+                    animation_state = "Blank"
+                    # Clear the display
+                    clear_all_layers()
+                    mark_display_drawn()
+                    notify_state_change()
+            was_active = active
         
-        # Check every minute
-        time.sleep(60)
+        # Sleep until the active hours start or end, or the schedule changes
+        schedule_changed.wait(min(seconds_until_schedule_change(), SCHEDULER_MAX_WAIT))
+        schedule_changed.clear()
 
 if __name__ == '__main__':
     # Set up signal handlers for graceful shutdown
@@ -1173,19 +1379,19 @@ if __name__ == '__main__':
     # Load settings from file
     load_settings()
     
+    # Encode the QR code now, rather than on the first switch to Stopped
+    generate_qr_code(SERVER_URL)
+    
     # Prepare log file
     if not os.path.isdir('logs'):
         os.makedirs('logs', exist_ok=True)
     log_file = os.path.join('logs', 'matrix_web.log')
     
     # Initialize display layers
-    fill_screen((0, 0, 0))  # Clear animation layer
-    fill_screen((0, 0, 0), layer=DISPLAY_TEXT_LAYER)  # Clear text layer
-    fill_screen((0, 0, 0), layer=QR_CODE_LAYER)  # Clear QR code layer
+    clear_all_layers()  # Clear animation, text and QR code layers
     
     # Check current time to determine initial state
-    current_time = time.strftime("%H:%M")
-    if start_time <= current_time < end_time:
+    if in_active_hours():
         # During active hours, show QR code
         print("Displaying QR code on LED matrix")
         url = display_qr_code()
@@ -1196,12 +1402,20 @@ if __name__ == '__main__':
         # Outside active hours, start in blank mode
         print("Outside active hours, starting in blank mode")
         animation_state = "Blank"
+    mark_display_drawn()
     
     # Start animation control thread
     animation_thread = threading.Thread(target=run_matrix_animation)
     animation_thread.daemon = True
     animation_thread.start()
     
+    # Start settings writer thread
+    settings_thread = threading.Thread(target=run_settings_writer)
+    settings_thread.daemon = True
+    settings_thread.start()
+    # Don't lose changes made in the writer's last second
+    atexit.register(flush_settings)
+    
     # Start scheduler thread
     scheduler_thread = threading.Thread(target=run_scheduler)
     scheduler_thread.daemon = True
@@ -1211,9 +1425,13 @@ if __name__ == '__main__':
     time.sleep(0.5)
     
     # Display server info
-    print(f"Starting web server at http://192.168.86.56:{PORT}")
+    print(f"Starting web server at {SERVER_URL}")
     print(f"This server will continue running even if the SSH session ends")
     print(f"Active hours: {start_time} to {end_time}")
     
-    # Run Flask app
-    app.run(host=HOST, port=PORT, debug=False, threaded=True) 
\ No newline at end of file
+    # Run Flask app. Waitress keeps HTTP/1.1 connections open between the
+    # page's requests; Flask's own server closes every connection.
+    if serve is not None:
+        serve(app, host=HOST, port=PORT, threads=8, connection_limit=200, channel_timeout=60)
+    else:
+        app.run(host=HOST, port=PORT, debug=False, threaded=True) 
\ No newline at end of file